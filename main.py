@@ -1,28 +1,62 @@
 import os
 import re
+import sys
+import atexit
+import asyncio
 import logging
 import json
+import time
+import threading
+from collections import deque
+from itertools import islice
 from datetime import datetime, timezone
-from typing import Dict, Any, List, Optional
-from urllib.parse import urlparse
+from html import escape
+from logging.handlers import MemoryHandler
+from typing import Awaitable, Callable, Deque, Dict, Any, FrozenSet, List, NamedTuple, Optional, Tuple, Union
 
 # Настройка логирования
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_FLUSH_INTERVAL = 3.0
+STORAGE_FLUSH_INTERVAL = 2.0
+
+def _buffered_file_handler(filename: str, fmt: str) -> MemoryHandler:
+    # Записи копятся в памяти и пишутся в файл пачкой: по заполнении буфера,
+    # по таймеру (см. flush_logs) или сразу при ERROR
+    target = logging.FileHandler(filename, encoding="utf-8")
+    target.setFormatter(logging.Formatter(fmt))
+    return MemoryHandler(capacity=64, flushLevel=logging.ERROR, target=target)
+
+bot_log_handler = _buffered_file_handler("bot.log", LOG_FORMAT)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler("bot.log", encoding="utf-8"),
+        bot_log_handler,
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Отдельный журнал новых постов
+post_log_handler = _buffered_file_handler("posts.log", '%(asctime)s - %(message)s')
+post_logger = logging.getLogger("posts")
+post_logger.addHandler(post_log_handler)
+# Журнал постов ведётся при любом LOG_LEVEL
+post_logger.setLevel(logging.INFO)
+# httpx пишет в INFO каждый HTTP-запрос, включая каждый цикл getUpdates
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def flush_logs() -> None:
+    bot_log_handler.flush()
+    post_log_handler.flush()
+
 # Попытка импорта
 try:
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+    from telegram.ext import AIORateLimiter, Application, BaseUpdateProcessor, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
     from telegram.error import BadRequest, TelegramError
     from telegram.constants import ParseMode
+    from telegram.request import HTTPXRequest
 except ImportError as e:
     logger.error(f"Не установлена библиотека python-telegram-bot: {e}")
     print("Установите: pip install python-telegram-bot")
@@ -36,6 +70,28 @@ try:
 except ImportError:
     logger.warning("Библиотека python-dotenv не установлена")
 
+# Быстрая сериализация JSON, если установлен orjson
+try:
+    import orjson
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+
+    def json_dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    json_loads = orjson.loads
+except ImportError:
+    logger.warning("Библиотека orjson не установлена, используется стандартный json")
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+    def json_dumps_line(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    json_loads = json.loads
+
 # Импорт текстов
 try:
     import texts
@@ -43,26 +99,56 @@ except ImportError:
     logger.error("Файл texts.py не найден. Создайте его рядом с main.py")
     exit(1)
 
+# Уровень логов задаётся после загрузки .env; в продакшене обычно WARNING
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+try:
+    logging.getLogger().setLevel(LOG_LEVEL)
+except ValueError:
+    logger.warning(f"Некорректный LOG_LEVEL: {LOG_LEVEL}, используется INFO")
+
 # Константы
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CHANNEL_ID = os.getenv('CHANNEL_ID')
 BOT_USERNAME = os.getenv('BOT_USERNAME', '').lstrip('@')
+# Если задан внешний адрес (https://домен), обновления принимаются вебхуком,
+# иначе бот работает через long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+# PORT нужен только вебхуку; хостинги выставляют его и для ботов на polling,
+# поэтому некорректное значение не должно мешать запуску
+WEBHOOK_PORT = 8443
+try:
+    WEBHOOK_PORT = int(os.getenv('PORT', WEBHOOK_PORT))
+except ValueError:
+    logger.warning(f"Некорректный PORT: {os.getenv('PORT')}, используется {WEBHOOK_PORT}")
 
-# Парсинг ADMIN_IDS
-ADMIN_IDS: List[int] = []
+# Парсинг ADMIN_IDS (frozenset: проверка `in` за O(1))
+admin_ids: List[int] = []
 admin_ids_str = os.getenv('ADMIN_IDS', '')
 for id_str in admin_ids_str.split(','):
     id_str = id_str.strip()
     if id_str.isdigit():
-        ADMIN_IDS.append(int(id_str))
+        admin_ids.append(int(id_str))
     elif id_str:
         logger.warning(f"Некорректный ID админа: {id_str}")
+ADMIN_IDS: FrozenSet[int] = frozenset(admin_ids)
 
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN не найден")
     print("Установите BOT_TOKEN в .env или переменных окружения")
     exit(1)
 
+# Разбор CHANNEL_ID один раз при запуске: числовой ID или username (с @ или без)
+CHANNEL_CHAT_ID: Optional[Union[int, str]] = None
+CHANNEL_LINK = ''
+if CHANNEL_ID:
+    if CHANNEL_ID.lstrip('-').isdigit():
+        CHANNEL_CHAT_ID = int(CHANNEL_ID)
+        CHANNEL_LINK = f"https://t.me/c/{CHANNEL_ID.replace('-100', '')}"
+    else:
+        CHANNEL_CHAT_ID = CHANNEL_ID if CHANNEL_ID.startswith('@') else f"@{CHANNEL_ID}"
+        CHANNEL_LINK = f"https://t.me/{CHANNEL_CHAT_ID.lstrip('@')}"
+
 # Категории
 CATEGORIES = {
     'technology': '📚 ТЕХНОЛОГИИ',
@@ -74,51 +160,347 @@ CATEGORIES = {
     'life': '🌿 ЖИЗНЬ'
 }
 
+# Статичные клавиатуры собираются один раз при загрузке модуля
+def build_markup(rows: List[List[Dict[str, str]]]) -> InlineKeyboardMarkup:
+    buttons = []
+    for row in rows:
+        if not isinstance(row, list):
+            continue
+        button_row = []
+        for btn in row:
+            if isinstance(btn, dict) and "text" in btn and "callback_data" in btn:
+                button_row.append(InlineKeyboardButton(btn["text"], callback_data=btn["callback_data"]))
+        if button_row:
+            buttons.append(button_row)
+    return InlineKeyboardMarkup(buttons)
+
+# callback_data кнопки категории -> ключ категории; словарь заменяет разбор строки
+CATEGORY_BY_CALLBACK: Dict[str, str] = {f"category_{key}": key for key in CATEGORIES}
+CATEGORY_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(CATEGORIES[key], callback_data=data)] for data, key in CATEGORY_BY_CALLBACK.items()]
+)
+WELCOME_MARKUP = build_markup(texts.WELCOME_BUTTONS)
+BACK_TO_CATEGORIES_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("↩️ Назад к категориям", callback_data="back_to_categories")]]
+)
+BACK_TO_TITLE_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("↩️ Назад к заголовку", callback_data="back_to_title")]]
+)
+OTHER_POSTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Я поддержал авторов", callback_data="support_done")],
+    [InlineKeyboardButton("📣 Пригласить друзей", callback_data="invite_friends")]
+])
+ADMIN_DELETE_ALL_MARKUP = InlineKeyboardMarkup(
+    [[InlineKeyboardButton(texts.ADMIN_DELETE_ALL_BUTTON, callback_data="confirm_delete_all")]]
+)
+# Ссылка «Поделиться» содержит имя пользователя, общая только кнопка «Назад»
+INVITE_BACK_ROW = (InlineKeyboardButton("↩️ Назад", callback_data="back_to_main"),)
+
+def build_subscription_markup(link: str) -> InlineKeyboardMarkup:
+    buttons = []
+    for btn in texts.SUBSCRIPTION_CHECK_BUTTONS:
+        button_text = btn["text"].format(channel_link=link)
+        if "url" in btn:
+            buttons.append([InlineKeyboardButton(button_text, url=btn["url"].format(channel_link=link))])
+        else:
+            buttons.append([InlineKeyboardButton(button_text, callback_data=btn["callback_data"])])
+    return InlineKeyboardMarkup(buttons)
+
+SUBSCRIPTION_MARKUP = build_subscription_markup(CHANNEL_LINK) if CHANNEL_LINK else None
+SUPPORT_DONE_MARKUP = build_markup(texts.SUPPORT_BUTTONS)
+
+# Время хранится как unix timestamp (float) и форматируется только при показе
+def to_timestamp(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value:
+        # Старые записи хранили ISO-строку
+        if value.endswith('Z'):
+            value = value[:-1] + '+00:00'
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return 0.0
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return dt.timestamp()
+    return 0.0
+
+def utc_day(ts: float) -> int:
+    # Номер суток UTC с начала эпохи: сравнение дат без разбора и datetime
+    return int(ts // 86400)
+
+def format_timestamp(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+# Запись поста: кортеж вместо словаря экономит память и ускоряет доступ к полям
+class Post(NamedTuple):
+    id: int
+    user_id: int
+    category: str
+    title: str
+    url: str
+    created_at: float
+    # Экранированные для HTML копии: считаются один раз при сохранении,
+    # а не при каждом показе ленты
+    title_html: str
+    url_html: str
+
+    @classmethod
+    def create(cls, post_id: int, user_id: int, category: str, title: str, url: str, created_at: float) -> 'Post':
+        return cls(
+            id=post_id,
+            user_id=user_id,
+            category=sys.intern(category),
+            title=title,
+            url=url,
+            created_at=created_at,
+            title_html=escape(title, quote=False),
+            url_html=escape(url, quote=True)
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Post':
+        title = data.get('title', '')
+        url = data.get('url', '')
+        return cls(
+            id=data.get('id', 0),
+            user_id=data.get('user_id', 0),
+            category=sys.intern(data.get('category', '')),
+            title=title,
+            url=url,
+            created_at=to_timestamp(data.get('created_at')),
+            title_html=escape(title, quote=False),
+            url_html=escape(url, quote=True)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        # На диск пишутся только исходные поля: HTML-копии пересчитывает from_dict
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'category': self.category,
+            'title': self.title,
+            'url': self.url,
+            'created_at': self.created_at
+        }
+
+# Общее состояние для пользователей без сессии; только для чтения, не изменять
+_DEFAULT_USER_STATE: Tuple[str, Dict[str, Any]] = ('start', {})
+
+def fsync_directory(filename: str) -> None:
+    # Фиксирует на диске запись каталога (rename/создание файла).
+    # На Windows каталог так не открыть — там это не требуется
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+def copy_file(src: str, dst: str) -> None:
+    # Копирование средствами ядра (copy_file_range, Linux) без буферов Python;
+    # на других системах и ФС без поддержки — обычный shutil.copy
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    if copy_file_range is not None:
+        try:
+            with open(src, 'rb') as s, open(dst, 'wb') as d:
+                while copy_file_range(s.fileno(), d.fileno(), 1 << 30) > 0:
+                    pass
+            return
+        except OSError:
+            pass
+    import shutil
+    shutil.copy(src, dst)
+
+# Сколько свежих постов каждой категории держать в индексе для ленты
+RECENT_POSTS_PER_CATEGORY = 50
+# Журнал постов сжимается, когда мёртвые строки (удалённые посты и их
+# метки удаления) составляют больше этой доли файла
+POSTS_LOG_COMPACT_RATIO = 0.2
+
 # Хранилище с сохранением в файл
 class JsonStorage:
-    def __init__(self, filename: str = "data.json"):
+    def __init__(self, filename: str = "data.json", posts_filename: str = "posts.jsonl"):
         self.filename = filename
         self.backup_filename = filename + ".backup"
+        # Посты хранятся отдельно, в журнале только для дозаписи: одна строка
+        # JSON на пост и метка {"op": "del", "id": N} на удаление. data.json
+        # с пользователями и счётчиком ID от числа постов больше не зависит
+        self.posts_filename = posts_filename
         data = self._load_data()
         self.data = data
         self.next_post_id = data.get('next_post_id', 1)
+        # Изменения пользователей не пишутся сразу, а помечают данные
+        # как изменённые; на диск их сбрасывает flush() (см. post_init)
+        self._dirty = False
+        # Номер последнего снимка data.json и последнего записанного на диск
+        self._data_generation = 0
+        self._written_generation = 0
+        self._write_lock = threading.Lock()
+        # Растёт при каждом изменении списка постов; по нему сбрасываются кэши
+        self.posts_version = 0
+        # Строк в журнале всего и из них уже не нужных — для решения о сжатии
+        self._log_lines = 0
+        self._log_dead = 0
+        # Журнал может оканчиваться недописанной строкой (см. _drop_torn_tail)
+        self._log_torn = False
+        legacy_posts = data.pop('posts', None)
+        log_exists = os.path.exists(self.posts_filename)
+        if log_exists:
+            self._posts, damaged = self._load_posts_log()
+            # Битую строку нужно убрать до первой дозаписи, иначе новая строка
+            # приклеится к недописанной
+            self._log_torn = damaged
+            if damaged or self._log_dead > self._log_lines * POSTS_LOG_COMPACT_RATIO:
+                self._compact_posts_log()
+        else:
+            # Первый запуск после перехода на журнал: посты ещё лежат в data.json
+            self._posts = [Post.from_dict(p) for p in legacy_posts or []]
+        # Индексы ниже рассчитывают на хронологический порядок списка (посты
+        # только добавляются в конец). Файл мог быть правлен вручную, поэтому
+        # упорядочиваем один раз при загрузке; sort устойчив и почти бесплатен
+        # для уже отсортированных данных
+        self._posts.sort(key=lambda p: p.created_at)
+        if legacy_posts is not None:
+            # Переносим посты в журнал, затем data.json переписывается уже без них.
+            # Если журнал записать не удалось, запускаться нельзя: первый же
+            # flush() сохранил бы data.json без постов, и они пропали бы совсем
+            if not log_exists:
+                if not self._compact_posts_log():
+                    raise RuntimeError(f"Не удалось перенести посты из {self.filename} в {self.posts_filename}")
+                logger.info(f"Посты перенесены в {self.posts_filename}: {len(self._posts)}")
+            self._dirty = True
+        # Состояние диалога: user_id -> [state, data]. Живёт только в памяти:
+        # это короткая переписка, после перезапуска её начинают заново с /start,
+        # а файл не переписывается на каждое нажатие кнопки
+        data.pop('user_states', None)
+        self.user_states: Dict[int, list] = {}
+        # В JSON ключи — строки; в памяти держим int, чтобы не вызывать str()
+        # на каждом обращении. Обратно в строки их превращает сериализатор
+        users: Dict[int, Any] = {}
+        for key, user in data.get('users', {}).items():
+            try:
+                users[int(key)] = user
+            except ValueError:
+                logger.warning(f"Некорректный ID пользователя в данных: {key}")
+        data['users'] = users
+        # Счётчик не должен отставать от уже выданных ID (например, после ручной правки файла)
+        if self.posts:
+            self.next_post_id = max(self.next_post_id, max(p.id for p in self.posts) + 1)
+        # Последние посты по категориям в порядке добавления (старые -> новые)
+        self.posts_by_category: Dict[str, Deque[Post]] = {
+            k: deque(maxlen=RECENT_POSTS_PER_CATEGORY) for k in CATEGORIES
+        }
+        # День (utc_day) последнего поста каждого автора для can_user_post
+        self._latest_day_by_user: Dict[int, int] = {}
+        # Поиск поста по ID для удаления
+        self._post_by_id: Dict[int, Post] = {}
+        for post in self.posts:
+            self._post_by_id[post.id] = post
+            bucket = self.posts_by_category.get(post.category)
+            if bucket is not None:
+                bucket.append(post)
+            self._update_latest_day(post)
 
     def _load_data(self) -> Dict[str, Any]:
         try:
             if os.path.exists(self.filename):
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                with open(self.filename, 'rb') as f:
+                    return json_loads(f.read())
         except Exception as e:
             logger.error(f"Ошибка загрузки данных: {e}")
             # Создаем резервную копию при ошибке
             if os.path.exists(self.filename):
                 try:
-                    import shutil
-                    shutil.copy(self.filename, self.backup_filename)
+                    copy_file(self.filename, self.backup_filename)
                     logger.info(f"Создана резервная копия: {self.backup_filename}")
                 except Exception as backup_error:
                     logger.error(f"Ошибка создания резервной копии: {backup_error}")
-        return {'posts': [], 'users': {}, 'user_states': {}, 'next_post_id': 1}
+        return {'users': {}, 'next_post_id': 1}
+
+    def _load_posts_log(self) -> Tuple[List[Post], bool]:
+        posts: Dict[int, Post] = {}
+        damaged = False
+        with open(self.posts_filename, 'rb') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                self._log_lines += 1
+                try:
+                    record = json_loads(line)
+                    if record.get('op') == 'del':
+                        post_id = record['id']
+                        posts.pop(post_id, None)
+                        # Метка не даёт снова выдать ID удалённого поста
+                        self.next_post_id = max(self.next_post_id, post_id + 1)
+                    else:
+                        post = Post.from_dict(record)
+                        posts[post.id] = post
+                except Exception as e:
+                    # Обычно это недописанная последняя строка после аварийной остановки
+                    logger.warning(f"Пропущена строка {number} журнала постов: {e}")
+                    damaged = True
+        self._log_dead = self._log_lines - len(posts)
+        return list(posts.values()), damaged
+
+    def _append_posts_log(self, record: Dict[str, Any]) -> bool:
+        if self._log_torn and not self._compact_posts_log():
+            return False
+        offset = None
+        try:
+            line = json_dumps_line(record) + b'\n'
+            created = not os.path.exists(self.posts_filename)
+            with open(self.posts_filename, 'ab') as f:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            if created:
+                fsync_directory(self.posts_filename)
+            self._log_lines += 1
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка записи в журнал постов: {e}")
+            if offset is not None:
+                self._drop_torn_tail(offset)
+            return False
 
-    def _save_data(self) -> bool:
+    def _drop_torn_tail(self, offset: int) -> None:
+        # Недописанная строка склеилась бы со следующей дозаписью, и пропали бы
+        # обе записи. Обрезаем журнал до прежней длины, а если не вышло —
+        # переписываем его из памяти, где неудачной записи ещё нет
         try:
-            # Создаем временную копию для безопасного сохранения
-            temp_filename = self.filename + ".tmp"
-            self.data['next_post_id'] = self.next_post_id
-            
-            with open(temp_filename, 'w', encoding='utf-8') as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-            
-            # Заменяем старый файл новым
-            if os.path.exists(self.filename):
-                os.replace(temp_filename, self.filename)
-            else:
-                os.rename(temp_filename, self.filename)
-                
+            os.truncate(self.posts_filename, offset)
+        except OSError as e:
+            logger.error(f"Ошибка обрезки журнала постов: {e}")
+            # Не вышло и это — тогда перед следующей дозаписью
+            self._log_torn = not self._compact_posts_log()
+
+    def _compact_posts_log(self) -> bool:
+        # Переписывает журнал одними живыми постами; замена атомарна, как в _save_data
+        temp_filename = self.posts_filename + ".tmp"
+        try:
+            encoded = b''.join(json_dumps_line(p.to_dict()) + b'\n' for p in self._posts)
+            with open(temp_filename, 'wb') as f:
+                f.write(encoded)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.posts_filename)
+            fsync_directory(self.posts_filename)
+            self._log_lines = len(self._posts)
+            self._log_dead = 0
+            self._log_torn = False
+            # Вместе с метками удаления пропадают и ID удалённых постов:
+            # теперь от повторной выдачи их защищает только next_post_id в data.json
+            self._dirty = True
             return True
         except Exception as e:
-            logger.error(f"Ошибка сохранения данных: {e}")
-            # Пытаемся удалить временный файл
+            logger.error(f"Ошибка сжатия журнала постов: {e}")
             try:
                 if os.path.exists(temp_filename):
                     os.remove(temp_filename)
@@ -126,72 +508,137 @@ class JsonStorage:
                 pass
             return False
 
-    @property
-    def posts(self) -> List[Dict[str, Any]]:
-        return self.data.get('posts', [])
+    def _encode_data(self) -> Tuple[int, bytes]:
+        # Снимок данных берётся только в потоке цикла событий, где они меняются
+        self.data['next_post_id'] = self.next_post_id
+        self._data_generation += 1
+        # Кодируем целиком в памяти и пишем одним вызовом: json.dump делает
+        # отдельный write() на каждый элемент структуры
+        return self._data_generation, json_dumps(self.data)
+
+    def _write_data(self, generation: int, encoded: bytes) -> bool:
+        # Может выполняться в пуле потоков (см. flush_async). Блокировка не даёт
+        # двум записям делить .tmp, а номер снимка — затереть свежий файл старым
+        with self._write_lock:
+            if generation <= self._written_generation:
+                return True
+            # Создаем временную копию для безопасного сохранения
+            temp_filename = self.filename + ".tmp"
+            try:
+                with open(temp_filename, 'wb') as f:
+                    f.write(encoded)
+                    # Данные должны оказаться на диске раньше, чем rename
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                # Заменяем старый файл новым
+                if os.path.exists(self.filename):
+                    os.replace(temp_filename, self.filename)
+                else:
+                    os.rename(temp_filename, self.filename)
+                fsync_directory(self.filename)
+
+                self._written_generation = generation
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка сохранения данных: {e}")
+                # Пытаемся удалить временный файл
+                try:
+                    if os.path.exists(temp_filename):
+                        os.remove(temp_filename)
+                except:
+                    pass
+                return False
+
+    def _save_data(self) -> bool:
+        try:
+            generation, encoded = self._encode_data()
+        except Exception as e:
+            logger.error(f"Ошибка сохранения данных: {e}")
+            return False
+        if not self._write_data(generation, encoded):
+            return False
+        self._dirty = False
+        return True
+
+    def _update_latest_day(self, post: Post) -> None:
+        day = utc_day(post.created_at)
+        if day > self._latest_day_by_user.get(post.user_id, -1):
+            self._latest_day_by_user[post.user_id] = day
+
+    def _rebuild_category(self, category: str) -> None:
+        # После удаления в окно должны вернуться более старые посты категории.
+        # Идём от свежих к старым и останавливаемся, как только окно заполнено
+        recent: Deque[Post] = deque(maxlen=RECENT_POSTS_PER_CATEGORY)
+        for post in reversed(self.posts):
+            if post.category == category:
+                recent.appendleft(post)
+                if len(recent) == RECENT_POSTS_PER_CATEGORY:
+                    break
+        self.posts_by_category[category] = recent
+
+    def flush(self) -> None:
+        if self._dirty:
+            self._save_data()
+
+    async def flush_async(self) -> None:
+        # Периодический сброс: fsync и rename выполняются в пуле потоков и не
+        # останавливают обработку обновлений
+        if not self._dirty:
+            return
+        generation, encoded = self._encode_data()
+        # Флаг снимается до записи: изменения, пришедшие во время неё, попадут в следующий сброс
+        self._dirty = False
+        try:
+            saved = await asyncio.to_thread(self._write_data, generation, encoded)
+        except BaseException:
+            # При отмене задачи (остановка бота) запись доделает flush() в post_shutdown
+            self._dirty = True
+            raise
+        if not saved:
+            self._dirty = True
 
     @property
-    def users(self) -> Dict[str, Any]:
-        return self.data.get('users', {})
+    def posts(self) -> List[Post]:
+        return self._posts
 
     @property
-    def user_states(self) -> Dict[str, Any]:
-        return self.data.get('user_states', {})
+    def users(self) -> Dict[int, Any]:
+        return self.data['users']
 
     def save_user(self, user_id: int, username: Optional[str] = None) -> None:
         if username:
-            self.users[str(user_id)] = {
+            self.users[user_id] = {
                 'username': username,
-                'last_active': datetime.now(timezone.utc).isoformat()
+                'last_active': time.time()
             }
-            self._save_data()
+            self._dirty = True
 
     def can_user_post(self, user_id: int) -> bool:
-        user_posts = [p for p in self.posts if p.get('user_id') == user_id]
-        if not user_posts:
-            return True
-
-        try:
-            latest_post = max(user_posts, key=lambda x: x.get('created_at', ''))
-            created_at = latest_post.get('created_at', '')
-            
-            if not created_at:
-                return True
-                
-            # Нормализуем формат даты
-            if created_at.endswith('Z'):
-                created_at = created_at[:-1] + '+00:00'
-                
-            post_dt = datetime.fromisoformat(created_at)
-            if post_dt.tzinfo is None:
-                post_dt = post_dt.replace(tzinfo=timezone.utc)
-
-            today = datetime.now(timezone.utc).date()
-            return post_dt.date() < today
-            
-        except (ValueError, KeyError) as e:
-            logger.warning(f"Ошибка проверки даты поста: {e}")
-            return True
+        return self._latest_day_by_user.get(user_id, -1) < utc_day(time.time())
 
     def save_post(self, user_id: int, category: str, title: str, url: str) -> Optional[int]:
         try:
-            post = {
-                'user_id': user_id,
-                'category': category,
-                'title': title,
-                'url': url,
-                'created_at': datetime.now(timezone.utc).isoformat(),
-                'id': self.next_post_id
-            }
+            post = Post.create(self.next_post_id, user_id, category, title, url, time.time())
+            # Сначала журнал, потом память: если запись не удалась, пост не должен
+            # появиться в ленте и занять дневной лимит автора
+            if not self._append_posts_log(post.to_dict()):
+                return None
+
             self.next_post_id += 1
             self.posts.append(post)
-            
-            if self._save_data():
-                username = self.users.get(str(user_id), {}).get('username', 'unknown')
-                logger.info(f"NEW_POST | UserID: {user_id} | Username: @{username} | "
-                           f"Category: {category} | Title: {title}")
-                return post['id']
-            return None
+            self._post_by_id[post.id] = post
+            if category in self.posts_by_category:
+                self.posts_by_category[category].append(post)
+            self._update_latest_day(post)
+            self.posts_version += 1
+            # Новый next_post_id попадёт в data.json при ближайшем flush()
+            self._dirty = True
+            if post_logger.isEnabledFor(logging.INFO):
+                username = self.users.get(user_id, {}).get('username', 'unknown')
+                post_logger.info("NEW_POST | UserID: %s | Username: @%s | Category: %s | Title: %s | URL: %s",
+                                 user_id, username, category, title, url)
+            return post.id
             
         except Exception as e:
             logger.error(f"Ошибка сохранения поста: {e}")
@@ -199,11 +646,30 @@ class JsonStorage:
 
     def delete_post(self, post_id: int) -> bool:
         try:
-            for i, post in enumerate(self.posts):
-                if post.get('id') == post_id:
-                    self.posts.pop(i)
-                    return self._save_data()
-            return False
+            post = self._post_by_id.get(post_id)
+            if post is None:
+                return False
+            # Метка удаления пишется до изменения памяти: при ошибке записи пост
+            # остаётся и в ленте, и в журнале
+            if not self._append_posts_log({'op': 'del', 'id': post_id}):
+                return False
+
+            del self._post_by_id[post_id]
+            self.posts.remove(post)
+            if post.category in self.posts_by_category:
+                self._rebuild_category(post.category)
+            if self._latest_day_by_user.get(post.user_id) == utc_day(post.created_at):
+                # Удалён пост за последний день автора: пересчитываем по оставшимся
+                del self._latest_day_by_user[post.user_id]
+                for other in self.posts:
+                    if other.user_id == post.user_id:
+                        self._update_latest_day(other)
+            self.posts_version += 1
+            # Мертвы теперь и строка поста, и сама метка удаления
+            self._log_dead += 2
+            if self._log_dead > self._log_lines * POSTS_LOG_COMPACT_RATIO:
+                self._compact_posts_log()
+            return True
         except Exception as e:
             logger.error(f"Ошибка удаления поста #{post_id}: {e}")
             return False
@@ -211,8 +677,15 @@ class JsonStorage:
     def delete_all_posts(self) -> int:
         try:
             count = len(self.posts)
-            self.data['posts'] = []
-            if self._save_data():
+            self._posts.clear()
+            for bucket in self.posts_by_category.values():
+                bucket.clear()
+            self._latest_day_by_user.clear()
+            self._post_by_id.clear()
+            self.posts_version += 1
+            # Пустой журнал пишется сразу; счётчик ID сохраняем тут же, иначе
+            # после перезапуска ID удалённых постов могли бы выдаться повторно
+            if self._compact_posts_log() and self._save_data():
                 logger.info(f"Удалено {count} постов (все)")
                 return count
             return 0
@@ -220,72 +693,142 @@ class JsonStorage:
             logger.error(f"Ошибка удаления всех постов: {e}")
             return 0
 
-    def get_recent_posts(self, limit_per_category: int = 5, max_total: int = 50) -> Dict[str, List[Dict[str, Any]]]:
+    def get_recent_posts(self, limit_per_category: int = 5, max_total: int = 50) -> Dict[str, List[Post]]:
         try:
-            posts_by_category = {}
-            all_posts = sorted(self.posts, key=lambda x: x.get('created_at', ''), reverse=True)
-
-            for category in CATEGORIES.keys():
-                filtered = [p for p in all_posts if p.get('category') == category]
-                posts_by_category[category] = filtered[:limit_per_category]
-
-            return {k: v for k, v in posts_by_category.items() if v}
+            recent = {}
+            # Посты только добавляются, поэтому свежие всегда в конце списка.
+            # Индекс построен в порядке CATEGORIES, пустые категории пропускаем сразу
+            for category, posts in self.posts_by_category.items():
+                if posts:
+                    recent[category] = list(islice(reversed(posts), limit_per_category))
+
+            return recent
         except Exception as e:
             logger.error(f"Ошибка получения постов: {e}")
             return {}
 
-    def get_user_state(self, user_id: int) -> Dict[str, Any]:
-        return self.user_states.get(str(user_id), {'state': 'start', 'data': {}})
+    def get_state_only(self, user_id: int) -> str:
+        return self.user_states.get(user_id, _DEFAULT_USER_STATE)[0]
+
+    def get_user_data(self, user_id: int) -> Dict[str, Any]:
+        # Для пользователя без состояния возвращается общий пустой словарь: только чтение
+        return self.user_states.get(user_id, _DEFAULT_USER_STATE)[1]
 
     def set_user_state(self, user_id: int, state: str, data: Optional[dict] = None) -> None:
-        if data is None:
-            data = {}
-        user_id_str = str(user_id)
-        current = self.user_states.get(user_id_str, {}).get('data', {})
-        current.update(data)
-        self.user_states[user_id_str] = {'state': state, 'data': current}
-        self._save_data()
+        current = self.user_states.get(user_id)
+        if current is None:
+            # Новую запись создаём только для пользователя без состояния
+            self.user_states[user_id] = [state, dict(data) if data else {}]
+        else:
+            current[0] = state
+            if data:
+                current[1].update(data)
 
     def clear_user_state(self, user_id: int) -> None:
-        user_id_str = str(user_id)
-        if user_id_str in self.user_states:
-            del self.user_states[user_id_str]
-            self._save_data()
+        self.user_states.pop(user_id, None)
 
 
 storage = JsonStorage()
+atexit.register(storage.flush)
+
+# Фильтр сообщений по состоянию диалога: ввод заголовка и ссылки получают
+# свои MessageHandler'ы вместо ветвления внутри handle_message
+class UserStateFilter(filters.UpdateFilter):
+    __slots__ = ('state',)
+
+    def __init__(self, state: str):
+        super().__init__(name=f"UserStateFilter({state})")
+        self.state = state
+
+    def filter(self, update: Update) -> bool:
+        user = update.effective_user
+        return user is not None and storage.get_state_only(user.id) == self.state
+
+# Валидация URL (шаблон компилируется один раз при загрузке модуля)
+_URL_RE = re.compile(r'^https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+(?::\d+)?(?:/?|[/?]\S+)$', re.IGNORECASE)
 
-# Валидация URL
 def is_valid_url(url: str) -> bool:
-    try:
-        result = urlparse(url.strip())
-        return all([result.scheme in ['http', 'https'], result.netloc])
-    except Exception:
-        return False
+    # Ожидается уже очищенная строка: handle_url_input делает strip()
+    return _URL_RE.match(url) is not None
 
 # Проверка подписки
+SUBSCRIPTION_CACHE_TTL = 60.0
+# Отказ кэшируем ненадолго: пользователь может подписаться в любой момент
+SUBSCRIPTION_NEGATIVE_CACHE_TTL = 5.0
+SUBSCRIPTION_CACHE_MAX_SIZE = 10000
+
+# user_id -> (срок действия по time.monotonic(), подписан ли)
+_subscription_cache: Dict[int, Tuple[float, bool]] = {}
+
+def _cache_subscription(user_id: int, is_member: bool) -> None:
+    # Словарь хранит порядок вставки: обновлённая запись уходит в конец,
+    # а при переполнении вытесняется самая старая
+    _subscription_cache.pop(user_id, None)
+    if len(_subscription_cache) >= SUBSCRIPTION_CACHE_MAX_SIZE:
+        del _subscription_cache[next(iter(_subscription_cache))]
+    ttl = SUBSCRIPTION_CACHE_TTL if is_member else SUBSCRIPTION_NEGATIVE_CACHE_TTL
+    _subscription_cache[user_id] = (time.monotonic() + ttl, is_member)
+
+def invalidate_subscription(user_id: int) -> None:
+    _subscription_cache.pop(user_id, None)
+
+async def ensure_channel_resolved(bot: Any) -> None:
+    # @username канала один раз превращаем в числовой ID, чтобы проверка
+    # подписки обходилась одним запросом get_chat_member вместо двух
+    global CHANNEL_CHAT_ID
+    if not isinstance(CHANNEL_CHAT_ID, str):
+        return
+    try:
+        chat = await bot.get_chat(CHANNEL_CHAT_ID)
+        logger.info(f"Канал {CHANNEL_CHAT_ID} -> ID {chat.id}")
+        CHANNEL_CHAT_ID = chat.id
+    except TelegramError as e:
+        # get_chat_member принимает и @username, так что бот продолжит работать
+        logger.warning(f"Не удалось получить ID канала {CHANNEL_CHAT_ID}: {e}")
+
 async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
     if not CHANNEL_ID:
         return True
 
-    try:
-        if CHANNEL_ID.startswith('@'):
-            chat = await context.bot.get_chat(CHANNEL_ID)
-            chat_id = chat.id
-        else:
-            try:
-                chat_id = int(CHANNEL_ID)
-            except ValueError:
-                logger.error(f"CHANNEL_ID должен быть @username или числовой ID: {CHANNEL_ID}")
-                return False
+    cached = _subscription_cache.get(user_id)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
 
-        member = await context.bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-        return member.status in ['member', 'administrator', 'creator']
+    try:
+        member = await context.bot.get_chat_member(chat_id=CHANNEL_CHAT_ID, user_id=user_id)
+        is_member = member.status in ['member', 'administrator', 'creator']
+        _cache_subscription(user_id, is_member)
+        return is_member
     except Exception as e:
         logger.error(f"Ошибка проверки подписки: {e}")
         return False
 
+# Ответ на update: при нажатии кнопки редактируем сообщение, иначе отвечаем новым.
+# Частоту запросов к Telegram ограничивает AIORateLimiter (см. main)
+async def send(update: Update, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None, **kwargs: Any) -> None:
+    if update.callback_query:
+        try:
+            await update.callback_query.edit_message_text(
+                text=text,
+                reply_markup=reply_markup,
+                parse_mode=ParseMode.HTML,
+                **kwargs
+            )
+        except BadRequest:
+            # В том числе "Message is not modified" при повторном показе того же экрана
+            pass
+    else:
+        await update.message.reply_text(
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.HTML,
+            **kwargs
+        )
+
 # === АДМИНСКИЕ ФУНКЦИИ ===
+# Лимит Telegram — 4096 символов на сообщение, оставляем запас под разметку
+ADMIN_MESSAGE_LIMIT = 3800
+
 async def admin_show_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_user.id not in ADMIN_IDS:
         await update.message.reply_text(texts.ERROR_ACCESS_DENIED, parse_mode=ParseMode.HTML)
@@ -297,33 +840,49 @@ async def admin_show_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
 
     count = min(10, len(posts))
-    text = texts.ADMIN_POSTS_HEADER.format(total=len(posts), count=count)
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+    header = texts.ADMIN_POSTS_HEADER.format(total=len(posts), count=count)
 
-    for post in posts[-count:]:
-        username = storage.users.get(str(post['user_id']), {}).get('username', 'unknown')
-        category = CATEGORIES.get(post['category'], post['category'])
+    # Склеиваем посты в как можно меньшее число сообщений, у каждого — своя клавиатура удаления
+    parts: List[str] = [header]
+    length = len(header)
+    keyboard: List[List[InlineKeyboardButton]] = []
 
-        message_text = texts.ADMIN_POST_FORMAT.format(
-            post_id=post['id'],
-            username=username,
-            user_id=post['user_id'],
-            category=category,
-            title=post['title'],
-            url=post['url'],
-            date=post['created_at'][:16].replace('T', ' ')
-        )
-
-        keyboard = [[InlineKeyboardButton(texts.ADMIN_DELETE_BUTTON, callback_data=f"admin_delete_{post['id']}")]]
+    async def flush() -> None:
         try:
             await update.message.reply_text(
-                text=message_text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                text="".join(parts),
+                reply_markup=InlineKeyboardMarkup(keyboard) if keyboard else None,
                 parse_mode=ParseMode.HTML,
                 disable_web_page_preview=True
             )
         except Exception as e:
-            logger.error(f"Ошибка отправки поста: {e}")
+            logger.error(f"Ошибка отправки постов: {e}")
+
+    for post in posts[-count:]:
+        username = storage.users.get(post.user_id, {}).get('username', 'unknown')
+        category = CATEGORIES.get(post.category, post.category)
+
+        message_text = texts.ADMIN_POST_FORMAT.format(
+            post_id=post.id,
+            username=username,
+            user_id=post.user_id,
+            category=category,
+            title=post.title_html,
+            url=post.url_html,
+            date=format_timestamp(post.created_at)
+        )
+
+        if keyboard and length + len(message_text) > ADMIN_MESSAGE_LIMIT:
+            await flush()
+            parts, length, keyboard = [], 0, []
+
+        parts.append(message_text)
+        length += len(message_text)
+        keyboard.append([InlineKeyboardButton(
+            f"{texts.ADMIN_DELETE_BUTTON} #{post.id}", callback_data=f"admin_delete_{post.id}"
+        )])
+
+    await flush()
 
 async def admin_delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     query = update.callback_query
@@ -334,25 +893,38 @@ async def admin_delete_post(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
 
     try:
-        post_id = int(query.data.replace('admin_delete_', ''))
+        post_id = int(query.data[len('admin_delete_'):])
     except ValueError:
-        await query.edit_message_text("❌ Неверный ID", parse_mode=ParseMode.HTML)
+        await query.message.reply_text("❌ Неверный ID", parse_mode=ParseMode.HTML)
         return
 
-    if storage.delete_post(post_id):
-        await query.edit_message_text(f"✅ Пост #{post_id} удалён", parse_mode=ParseMode.HTML)
+    deleted = storage.delete_post(post_id)
+
+    # В сообщении несколько постов — убираем только кнопку удалённого, остальные оставляем
+    markup = query.message.reply_markup
+    if markup:
+        rows = [
+            row for row in markup.inline_keyboard
+            if not any(button.callback_data == query.data for button in row)
+        ]
+        try:
+            await query.edit_message_reply_markup(InlineKeyboardMarkup(rows) if rows else None)
+        except BadRequest:
+            pass
+
+    if deleted:
+        await query.message.reply_text(f"✅ Пост #{post_id} удалён", parse_mode=ParseMode.HTML)
     else:
-        await query.edit_message_text(texts.ERROR_POST_NOT_FOUND, parse_mode=ParseMode.HTML)
+        await query.message.reply_text(texts.ERROR_POST_NOT_FOUND, parse_mode=ParseMode.HTML)
 
 async def admin_delete_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if update.effective_user.id not in ADMIN_IDS:
         await update.message.reply_text(texts.ERROR_ACCESS_DENIED, parse_mode=ParseMode.HTML)
         return
 
-    keyboard = [[InlineKeyboardButton(texts.ADMIN_DELETE_ALL_BUTTON, callback_data="confirm_delete_all")]]
     await update.message.reply_text(
         texts.ADMIN_DELETE_ALL_CONFIRM,
-        reply_markup=InlineKeyboardMarkup(keyboard),
+        reply_markup=ADMIN_DELETE_ALL_MARKUP,
         parse_mode=ParseMode.HTML
     )
 
@@ -389,37 +961,7 @@ async def show_subscription_required(update: Update, context: ContextTypes.DEFAU
             await show_welcome(update, context)
             return
 
-        if CHANNEL_ID.startswith('@'):
-            link = f"https://t.me/{CHANNEL_ID.lstrip('@')}"
-        else:
-            clean_id = CHANNEL_ID.replace('-100', '')
-            link = f"https://t.me/c/{clean_id}"
-
-        buttons = []
-        for btn in texts.SUBSCRIPTION_CHECK_BUTTONS:
-            button_text = btn["text"].format(channel_link=link)
-            if "url" in btn:
-                buttons.append([InlineKeyboardButton(button_text, url=btn["url"].format(channel_link=link))])
-            else:
-                buttons.append([InlineKeyboardButton(button_text, callback_data=btn["callback_data"])])
-
-        reply_markup = InlineKeyboardMarkup(buttons)
-
-        if update.callback_query:
-            try:
-                await update.callback_query.edit_message_text(
-                    text=texts.SUBSCRIPTION_REQUIRED,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.HTML
-                )
-            except BadRequest:
-                pass
-        else:
-            await update.message.reply_text(
-                text=texts.SUBSCRIPTION_REQUIRED,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
+        await send(update, texts.SUBSCRIPTION_REQUIRED, reply_markup=SUBSCRIPTION_MARKUP)
     except Exception as e:
         logger.error(f"Ошибка показа подписки: {e}")
         await error_handler(update, context)
@@ -432,34 +974,7 @@ async def show_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
             await show_subscription_required(update, context)
             return
 
-        buttons = []
-        for row in texts.WELCOME_BUTTONS:
-            if not isinstance(row, list):
-                continue
-            button_row = []
-            for btn in row:
-                if isinstance(btn, dict) and "text" in btn and "callback_data" in btn:
-                    button_row.append(InlineKeyboardButton(btn["text"], callback_data=btn["callback_data"]))
-            if button_row:
-                buttons.append(button_row)
-
-        reply_markup = InlineKeyboardMarkup(buttons)
-
-        if update.callback_query:
-            try:
-                await update.callback_query.edit_message_text(
-                    text=texts.WELCOME_MESSAGE,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.HTML
-                )
-            except BadRequest:
-                pass
-        else:
-            await update.message.reply_text(
-                text=texts.WELCOME_MESSAGE,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
+        await send(update, texts.WELCOME_MESSAGE, reply_markup=WELCOME_MARKUP)
     except Exception as e:
         logger.error(f"Ошибка приветствия: {e}")
         await error_handler(update, context)
@@ -475,13 +990,9 @@ async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await show_subscription_required(update, context)
             return
 
-        keyboard = []
-        for key, value in CATEGORIES.items():
-            keyboard.append([InlineKeyboardButton(value, callback_data=f"category_{key}")])
-
         await query.edit_message_text(
             text=texts.CHOOSE_CATEGORY,
-            reply_markup=InlineKeyboardMarkup(keyboard),
+            reply_markup=CATEGORY_MARKUP,
             parse_mode=ParseMode.HTML
         )
         storage.set_user_state(update.effective_user.id, 'awaiting_category')
@@ -500,16 +1011,16 @@ async def handle_category_selection(update: Update, context: ContextTypes.DEFAUL
             await show_subscription_required(update, context)
             return
 
-        category_key = query.data.replace('category_', '')
+        category_key = CATEGORY_BY_CALLBACK.get(query.data)
 
-        if category_key not in CATEGORIES:
+        if category_key is None:
             await query.edit_message_text("❌ Ошибка выбора", parse_mode=ParseMode.HTML)
             return
 
         storage.set_user_state(user_id, 'awaiting_title', {'category': category_key})
         await query.edit_message_text(
             text=texts.AWAITING_TITLE.format(category=CATEGORIES[category_key]),
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад к категориям", callback_data="back_to_categories")]]),
+            reply_markup=BACK_TO_CATEGORIES_MARKUP,
             parse_mode=ParseMode.HTML
         )
     except Exception as e:
@@ -534,7 +1045,7 @@ async def handle_title_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text(texts.TITLE_TOO_LONG, parse_mode=ParseMode.HTML)
             return
 
-        user_data = storage.get_user_state(user_id)['data']
+        user_data = storage.get_user_data(user_id)
         category = user_data.get('category')
 
         if not category:
@@ -550,7 +1061,7 @@ async def handle_title_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         storage.set_user_state(user_id, 'awaiting_url', {'category': category, 'title': title})
         await update.message.reply_text(
             text=texts.AWAITING_URL,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад к заголовку", callback_data="back_to_title")]]),
+            reply_markup=BACK_TO_TITLE_MARKUP,
             parse_mode=ParseMode.HTML
         )
     except Exception as e:
@@ -570,7 +1081,7 @@ async def handle_url_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             return
 
         url = update.message.text.strip()
-        user_data = storage.get_user_state(user_id)['data']
+        user_data = storage.get_user_data(user_id)
 
         if 'category' not in user_data or 'title' not in user_data:
             await update.message.reply_text("⚠️ Данные утеряны. Начнём сначала.", parse_mode=ParseMode.HTML)
@@ -593,6 +1104,33 @@ async def handle_url_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         logger.error(f"Ошибка ввода URL: {e}")
         await error_handler(update, context)
 
+# Лента одинакова для всех пользователей и меняется только вместе с постами,
+# поэтому готовый HTML кэшируется до следующего изменения storage.posts_version
+_feed_cache: Optional[Tuple[int, Optional[str]]] = None
+
+def render_other_posts() -> Optional[str]:
+    global _feed_cache
+    if _feed_cache is not None and _feed_cache[0] == storage.posts_version:
+        return _feed_cache[1]
+
+    posts_by_cat = storage.get_recent_posts()
+    text = None
+    if posts_by_cat:
+        parts = [texts.OTHER_POSTS_HEADER]
+        for cat, posts in posts_by_cat.items():
+            parts.append(f"\n<b>{CATEGORIES[cat]}</b>:\n")
+            parts.extend(f'• <a href="{post.url_html}">{post.title_html}</a>\n' for post in posts)
+            parts.append("\n")
+        parts.append(texts.OTHER_POSTS_FOOTER)
+        text = "".join(parts)
+
+        # Проверяем длину сообщения
+        if len(text) > 4096:
+            text = texts.OTHER_POSTS_HEADER + "\n\n⚠️ Слишком много постов для отображения. Используйте /admin для просмотра всех."
+
+    _feed_cache = (storage.posts_version, text)
+    return text
+
 async def show_other_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         # Проверяем подписку
@@ -601,49 +1139,12 @@ async def show_other_posts(update: Update, context: ContextTypes.DEFAULT_TYPE) -
             await show_subscription_required(update, context)
             return
 
-        posts_by_cat = storage.get_recent_posts()
-        if not posts_by_cat:
-            text = texts.NO_OTHER_POSTS
-            if update.callback_query:
-                await update.callback_query.edit_message_text(text, parse_mode=ParseMode.HTML)
-            else:
-                await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+        text = render_other_posts()
+        if text is None:
+            await send(update, texts.NO_OTHER_POSTS)
             return
 
-        text = texts.OTHER_POSTS_HEADER
-        for cat, posts in posts_by_cat.items():
-            text += f"\n<b>{CATEGORIES[cat]}</b>:\n"
-            for post in posts:
-                text += f'• <a href="{post["url"]}">{post["title"]}</a>\n'
-            text += "\n"
-        text += texts.OTHER_POSTS_FOOTER
-
-        # Проверяем длину сообщения
-        if len(text) > 4096:
-            text = texts.OTHER_POSTS_HEADER + "\n\n⚠️ Слишком много постов для отображения. Используйте /admin для просмотра всех."
-
-        keyboard = [
-            [InlineKeyboardButton("✅ Я поддержал авторов", callback_data="support_done")],
-            [InlineKeyboardButton("📣 Пригласить друзей", callback_data="invite_friends")]
-        ]
-
-        if update.callback_query:
-            try:
-                await update.callback_query.edit_message_text(
-                    text=text,
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                    parse_mode=ParseMode.HTML,
-                    disable_web_page_preview=True
-                )
-            except BadRequest:
-                pass
-        else:
-            await update.message.reply_text(
-                text=text,
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
+        await send(update, text, reply_markup=OTHER_POSTS_MARKUP, disable_web_page_preview=True)
 
         storage.set_user_state(update.effective_user.id, 'awaiting_support_confirmation')
     except Exception as e:
@@ -657,10 +1158,7 @@ async def handle_support_done(update: Update, context: ContextTypes.DEFAULT_TYPE
     storage.clear_user_state(user_id)
     await query.edit_message_text(
         text=texts.SUPPORT_DONE,
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("🔄 Начать заново", callback_data="start_over")],
-            [InlineKeyboardButton("📣 Пригласить друзей", callback_data="invite_friends")]
-        ]),
+        reply_markup=SUPPORT_DONE_MARKUP,
         parse_mode=ParseMode.HTML
     )
 
@@ -674,7 +1172,7 @@ async def handle_invite_friends(update: Update, context: ContextTypes.DEFAULT_TY
         text=texts.INVITE_FRIENDS,
         reply_markup=InlineKeyboardMarkup([
             [InlineKeyboardButton("🔗 Поделиться приглашением", url=share_url)],
-            [InlineKeyboardButton("↩️ Назад", callback_data="back_to_main")]
+            INVITE_BACK_ROW
         ]),
         parse_mode=ParseMode.HTML
     )
@@ -688,13 +1186,13 @@ async def handle_back_navigation(update: Update, context: ContextTypes.DEFAULT_T
     if data == "back_to_categories":
         await show_categories(update, context)
     elif data == "back_to_title":
-        user_data = storage.get_user_state(user_id)['data']
+        user_data = storage.get_user_data(user_id)
         if 'category' not in user_data:
             await start(update, context)
             return
         await query.edit_message_text(
             text=texts.AWAITING_TITLE.format(category=CATEGORIES[user_data['category']]),
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Назад к категориям", callback_data="back_to_categories")]]),
+            reply_markup=BACK_TO_CATEGORIES_MARKUP,
             parse_mode=ParseMode.HTML
         )
     elif data == "start_over":
@@ -706,7 +1204,9 @@ async def handle_check_subscription(update: Update, context: ContextTypes.DEFAUL
     query = update.callback_query
     await query.answer()
     user_id = update.effective_user.id
-    
+
+    # Пользователь явно просит перепроверить подписку — кэш ему не подходит
+    invalidate_subscription(user_id)
     if await check_subscription(user_id, context):
         # Пользователь подписан - показываем основное меню
         try:
@@ -749,17 +1249,12 @@ async def handle_view_posts_only(update: Update, context: ContextTypes.DEFAULT_T
     await show_other_posts(update, context)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Сюда попадает текст вне диалога: заголовок и ссылку ловят
+    # обработчики с UserStateFilter, зарегистрированные раньше
     if not update.message or not update.message.text:
         return
 
-    user_id = update.effective_user.id
-    state = storage.get_user_state(user_id)['state']
-
-    if state == 'awaiting_title':
-        await handle_title_input(update, context)
-    elif state == 'awaiting_url':
-        await handle_url_input(update, context)
-    elif not update.message.text.startswith('/'):
+    if not update.message.text.startswith('/'):
         await update.message.reply_text("Используйте /start", parse_mode=ParseMode.HTML)
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -770,33 +1265,208 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         except:
             pass
 
+# === ФОНОВЫЕ ЗАДАЧИ ===
+_background_tasks: List[asyncio.Task] = []
+
+async def _run_periodically(interval: float, func: Callable[[], Awaitable[None]]) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await func()
+        except Exception as e:
+            logger.error(f"Ошибка фоновой задачи {func.__name__}: {e}")
+
+async def flush_logs_async() -> None:
+    # Обработчики logging потокобезопасны, запись файлов уходит в пул потоков
+    await asyncio.to_thread(flush_logs)
+
+async def post_init(application: Application) -> None:
+    await ensure_channel_resolved(application.bot)
+    _background_tasks.append(asyncio.create_task(_run_periodically(LOG_FLUSH_INTERVAL, flush_logs_async)))
+    _background_tasks.append(asyncio.create_task(_run_periodically(STORAGE_FLUSH_INTERVAL, storage.flush_async)))
+
+async def post_shutdown(application: Application) -> None:
+    for task in _background_tasks:
+        task.cancel()
+    _background_tasks.clear()
+    storage.flush()
+    flush_logs()
+
+# Все нажатия кнопок проходят через один обработчик: кнопки без параметров
+# ищутся по точному callback_data в словаре, остальные — по префиксу
+CB_DISPATCH: Dict[str, Callable] = {
+    "support_done": handle_support_done,
+    "invite_friends": handle_invite_friends,
+    "check_subscription": handle_check_subscription,
+    "view_posts_only": handle_view_posts_only,
+    "next_to_categories": show_categories,
+}
+if ADMIN_IDS:
+    CB_DISPATCH["confirm_delete_all"] = admin_delete_all_callback
+# "back_to_" покрывается префиксом "back_"
+CB_PREFIX_ROUTES: Tuple[Tuple[str, Callable], ...] = (
+    ("category_", handle_category_selection),
+    ("back_", handle_back_navigation),
+    ("start_over", handle_back_navigation),
+    ("admin_delete_", admin_delete_post),
+)
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    data = query.data if isinstance(query.data, str) else ''
+    handler = CB_DISPATCH.get(data)
+    if handler is None:
+        for prefix, prefix_handler in CB_PREFIX_ROUTES:
+            if data.startswith(prefix):
+                handler = prefix_handler
+                break
+        else:
+            # Устаревшая или чужая кнопка: просто гасим индикатор загрузки
+            await query.answer()
+            return
+    await handler(update, context)
+
+# HTTP/2 держит одно мультиплексированное соединение вместо пула HTTP/1.1;
+# httpx умеет его только при установленном h2
+try:
+    import h2  # noqa: F401
+    HTTP_VERSION = "2"
+except ImportError:
+    logger.warning("Библиотека h2 не установлена, запросы к Bot API идут по HTTP/1.1")
+    HTTP_VERSION = "1.1"
+
+# Ответы Bot API (в первую очередь пачки getUpdates) разбираются через
+# json_loads, то есть orjson, если он установлен
+class FastJsonRequest(HTTPXRequest):
+    __slots__ = ()
+
+    @staticmethod
+    def parse_json_payload(payload: bytes) -> Dict[str, Any]:
+        try:
+            return json_loads(payload)
+        except ValueError as exc:
+            raise TelegramError("Invalid server response") from exc
+
+# Обновления обрабатываются параллельно (до max_running_updates), но
+# обновления одного пользователя — строго по очереди: состояние диалога
+# и проверка "один пост в сутки" рассчитаны на последовательные шаги
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    __slots__ = ('_user_locks', '_running')
+
+    def __init__(self, max_running_updates: int):
+        # Семафор базового класса держат и обновления, ждущие очереди своего
+        # пользователя, поэтому его предел не ограничиваем: иначе один
+        # пользователь, завалив бота нажатиями, занял бы все места. PTB всё
+        # равно создаёт задачу на каждое полученное обновление
+        super().__init__(sys.maxsize)
+        # Одновременно выполняемые обработчики ограничивает свой семафор,
+        # который берётся только после очереди пользователя
+        self._running = asyncio.BoundedSemaphore(max_running_updates)
+        # user_id -> [lock, число обновлений в работе]; запись удаляется,
+        # когда у пользователя не остаётся обновлений
+        self._user_locks: Dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Any) -> None:
+        user = update.effective_user if isinstance(update, Update) else None
+        if user is None:
+            async with self._running:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(user.id)
+        if entry is None:
+            entry = self._user_locks[user.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._running:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._user_locks[user.id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+# Бот обрабатывает только сообщения и нажатия кнопок; остальные типы
+# обновлений Telegram не присылает вовсе
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY]
+
 def main() -> None:
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Цикл событий на libuv быстрее стандартного; на Windows uvloop недоступен
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        logger.warning("Библиотека uvloop не установлена, используется стандартный цикл asyncio")
+
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # Свой request заменяет настройки билдера, поэтому пул задаём как у
+        # стандартного: 256 соединений для вызовов API, одно для getUpdates.
+        # Ожидание свободного соединения — до 5 с вместо 1 с по умолчанию,
+        # чтобы всплеск ответов не падал с TimedOut на занятом пуле
+        .request(FastJsonRequest(
+            connection_pool_size=256,
+            pool_timeout=5.0,
+            connect_timeout=5.0,
+            read_timeout=30.0,
+            http_version=HTTP_VERSION
+        ))
+        .get_updates_request(FastJsonRequest(http_version=HTTP_VERSION))
+        .concurrent_updates(PerUserUpdateProcessor(256))
+    )
+
+    # Сглаживаем всплески исходящих запросов вместо ответов 429 от Telegram
+    try:
+        builder.rate_limiter(AIORateLimiter(overall_max_rate=25, overall_time_period=1))
+    except RuntimeError:
+        logger.warning("Библиотека aiolimiter не установлена, ограничение частоты запросов отключено")
+
+    application = builder.build()
+
+    # Обработчики одной группы проверяются по порядку до первого совпадения,
+    # поэтому самые частые идут первыми. Почти весь диалог — нажатия кнопок
+    application.add_handler(CallbackQueryHandler(route_callback))
+
+    # Ввод заголовка и ссылки должен проверяться раньше общего текстового обработчика
+    text_filter = filters.TEXT & ~filters.COMMAND
+    application.add_handler(MessageHandler(text_filter & UserStateFilter('awaiting_title'), handle_title_input))
+    application.add_handler(MessageHandler(text_filter & UserStateFilter('awaiting_url'), handle_url_input))
+    application.add_handler(MessageHandler(text_filter, handle_message))
 
     application.add_handler(CommandHandler("start", start))
-    
+
     # Админские команды
     if ADMIN_IDS:
         application.add_handler(CommandHandler("admin", admin_show_posts))
         application.add_handler(CommandHandler("delete_all", admin_delete_all_command))
-        application.add_handler(CallbackQueryHandler(admin_delete_all_callback, pattern=r"^confirm_delete_all$"))
-
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-
-    # Обработчики callback-запросов
-    application.add_handler(CallbackQueryHandler(handle_category_selection, pattern=r"^category_"))
-    application.add_handler(CallbackQueryHandler(handle_support_done, pattern=r"^support_done$"))
-    application.add_handler(CallbackQueryHandler(handle_invite_friends, pattern=r"^invite_friends$"))
-    application.add_handler(CallbackQueryHandler(handle_check_subscription, pattern=r"^check_subscription$"))
-    application.add_handler(CallbackQueryHandler(handle_view_posts_only, pattern=r"^view_posts_only$"))
-    application.add_handler(CallbackQueryHandler(handle_back_navigation, pattern=r"^(back_|start_over|back_to_)"))
-    application.add_handler(CallbackQueryHandler(admin_delete_post, pattern=r"^admin_delete_"))
-    application.add_handler(CallbackQueryHandler(show_categories, pattern=r"^next_to_categories$"))
 
     application.add_error_handler(error_handler)
 
-    logger.info("Бот запущен. Ожидание обновлений...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+    if WEBHOOK_URL:
+        logger.info(f"Бот запущен. Вебхук: {WEBHOOK_URL}, порт {WEBHOOK_PORT}")
+        # Токен в пути отсекает запросы, пришедшие не от Telegram
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True
+        )
+    else:
+        logger.info("Бот запущен. Ожидание обновлений...")
+        # Максимальный long poll Telegram: в простое один getUpdates раз в 50 с
+        # вместо раза в 10 с. PTB сам прибавляет timeout к read_timeout запроса
+        application.run_polling(timeout=50, allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,177 @@
+"""Проверки журнала постов JsonStorage: python -m unittest test_storage"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+from itertools import chain, repeat
+from unittest import mock
+
+# main.py при импорте создаёт bot.log, posts.log и data.json в текущем каталоге,
+# поэтому импортируем его из временного каталога
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault('BOT_TOKEN', 'test')
+_cwd = os.getcwd()
+_import_dir = tempfile.TemporaryDirectory()
+os.chdir(_import_dir.name)
+try:
+    import main
+finally:
+    os.chdir(_cwd)
+
+CATEGORY = next(iter(main.CATEGORIES))
+
+
+def legacy_post(post_id: int) -> dict:
+    return {
+        'id': post_id,
+        'user_id': 100 + post_id,
+        'category': CATEGORY,
+        'title': f'Пост {post_id}',
+        'url': f'https://example.com/{post_id}',
+        'created_at': 1700000000.0 + post_id,
+    }
+
+
+class PostsLogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.data_file = os.path.join(self.tmp.name, 'data.json')
+        self.log_file = os.path.join(self.tmp.name, 'posts.jsonl')
+
+    def open_storage(self) -> main.JsonStorage:
+        return main.JsonStorage(self.data_file, self.log_file)
+
+    def write_legacy_data(self, *post_ids: int) -> None:
+        with open(self.data_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'users': {},
+                'posts': [legacy_post(i) for i in post_ids],
+                'next_post_id': max(post_ids) + 1,
+            }, f)
+
+    def read_data(self) -> dict:
+        with open(self.data_file, 'rb') as f:
+            return json.loads(f.read())
+
+    def read_log(self) -> bytes:
+        with open(self.log_file, 'rb') as f:
+            return f.read()
+
+    def failing_fsync(self):
+        # Запись дошла до файла, но не подтвердилась: строку нужно убрать.
+        # Следующие вызовы (например, при переписывании журнала) проходят
+        return mock.patch.object(main.os, 'fsync', side_effect=chain([OSError('disk full')], repeat(None)))
+
+    def test_migration_moves_posts_to_log(self):
+        self.write_legacy_data(1, 2)
+        storage = self.open_storage()
+        self.assertEqual([p.id for p in storage.posts], [1, 2])
+        self.assertTrue(os.path.exists(self.log_file))
+        storage.flush()
+        data = self.read_data()
+        self.assertNotIn('posts', data)
+        self.assertEqual(data['next_post_id'], 3)
+
+        reopened = self.open_storage()
+        self.assertEqual([p.id for p in reopened.posts], [1, 2])
+        self.assertEqual(reopened.next_post_id, 3)
+        # HTML-копии полей не хранятся, а считаются при загрузке
+        self.assertNotIn(b'title_html', self.read_log())
+        self.assertEqual(reopened.posts[0].title_html, 'Пост 1')
+
+    def test_failed_migration_keeps_posts_in_data(self):
+        self.write_legacy_data(1)
+        # Временный файл журнала не создать: на его месте каталог
+        os.mkdir(self.log_file + '.tmp')
+        with self.assertRaises(RuntimeError):
+            self.open_storage()
+        self.assertFalse(os.path.exists(self.log_file))
+        self.assertEqual([p['id'] for p in self.read_data()['posts']], [1])
+
+    def test_torn_last_line_is_dropped(self):
+        storage = self.open_storage()
+        first = storage.save_post(1, CATEGORY, 'Первый', 'https://example.com/1')
+        storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2')
+        storage.flush()
+        # Обрезаем последнюю строку, как при аварийной остановке посреди записи
+        with open(self.log_file, 'rb') as f:
+            content = f.read()
+        with open(self.log_file, 'wb') as f:
+            f.write(content[:-10])
+
+        reopened = self.open_storage()
+        self.assertEqual([p.id for p in reopened.posts], [first])
+        # Журнал сжат, и новая строка не приклеивается к недописанной
+        third = reopened.save_post(3, CATEGORY, 'Третий', 'https://example.com/3')
+        self.assertEqual([p.id for p in self.open_storage().posts], [first, third])
+
+    def test_tombstone_replay(self):
+        storage = self.open_storage()
+        # Постов достаточно, чтобы одно удаление не вызвало сжатие журнала
+        ids = [storage.save_post(i, CATEGORY, f'Пост {i}', f'https://example.com/{i}') for i in range(1, 11)]
+        self.assertTrue(storage.delete_post(ids[-1]))
+        # Журнал не сжат: в нём остались строка поста и метка удаления
+        self.assertIn(b'"op":"del"', self.read_log())
+
+        # data.json не сохранён: ID удалённого поста восстанавливается по метке
+        reopened = self.open_storage()
+        self.assertEqual([p.id for p in reopened.posts], ids[:-1])
+        self.assertEqual(reopened.next_post_id, ids[-1] + 1)
+
+    def test_failed_save_leaves_no_trace(self):
+        storage = self.open_storage()
+        first = storage.save_post(1, CATEGORY, 'Первый', 'https://example.com/1')
+        log_before = self.read_log()
+        with self.failing_fsync():
+            self.assertIsNone(storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2'))
+
+        self.assertEqual(self.read_log(), log_before)
+        self.assertEqual([p.id for p in storage.posts], [first])
+        self.assertEqual([p.id for p in storage.get_recent_posts().get(CATEGORY, [])], [first])
+        self.assertTrue(storage.can_user_post(2))
+        # Следующая запись получает тот же ID и не склеивается с неудачной
+        second = storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2')
+        self.assertEqual(second, first + 1)
+        self.assertEqual([p.id for p in self.open_storage().posts], [first, second])
+
+    def test_failed_delete_keeps_post(self):
+        storage = self.open_storage()
+        post_id = storage.save_post(1, CATEGORY, 'Пост', 'https://example.com/1')
+        log_before = self.read_log()
+        with self.failing_fsync():
+            self.assertFalse(storage.delete_post(post_id))
+
+        self.assertEqual(self.read_log(), log_before)
+        self.assertEqual([p.id for p in storage.posts], [post_id])
+        self.assertEqual([p.id for p in storage.get_recent_posts()[CATEGORY]], [post_id])
+        self.assertFalse(storage.can_user_post(1))
+        self.assertTrue(storage.delete_post(post_id))
+        self.assertEqual(self.open_storage().posts, [])
+
+    def test_failed_truncate_rewrites_log(self):
+        storage = self.open_storage()
+        first = storage.save_post(1, CATEGORY, 'Первый', 'https://example.com/1')
+        with self.failing_fsync(), mock.patch.object(main.os, 'truncate', side_effect=OSError('read-only')):
+            self.assertIsNone(storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2'))
+        # Журнал переписан из памяти и снова заканчивается переводом строки
+        self.assertTrue(self.read_log().endswith(b'\n'))
+        self.assertEqual([p.id for p in self.open_storage().posts], [first])
+
+    def test_torn_tail_is_removed_before_next_append(self):
+        storage = self.open_storage()
+        first = storage.save_post(1, CATEGORY, 'Первый', 'https://example.com/1')
+        # Не удалось ни обрезать журнал, ни переписать его
+        with mock.patch.object(main.os, 'fsync', side_effect=OSError('disk full')), \
+                mock.patch.object(main.os, 'truncate', side_effect=OSError('read-only')):
+            self.assertIsNone(storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2'))
+        second = storage.save_post(2, CATEGORY, 'Второй', 'https://example.com/2')
+        # Неудачная строка убрана переписыванием журнала, а не осталась перед новой
+        self.assertEqual(self.read_log().count(b'\n'), 2)
+        self.assertEqual([p.id for p in self.open_storage().posts], [first, second])
+
+
+if __name__ == '__main__':
+    unittest.main()